@@ -0,0 +1,235 @@
+"""
+Admission control for the heavy endpoints (archive downloads, backup, restore).
+
+Requests are never blocked waiting for a slot. A client that cannot run right
+away gets a ticket in a FIFO queue and is told to retry; retrying with the same
+client key keeps its place. Identical archive builds running at the same time
+are coalesced so every waiter shares one result.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class AdmissionDenied(Exception):
+    """Raised when a request cannot be admitted yet; the app turns it into a 429."""
+
+    def __init__(self, gate_name, position, retry_after):
+        super().__init__(f"{gate_name} busy")
+        self.gate_name = gate_name
+        self.position = position  # None when the queue is full
+        self.retry_after = retry_after
+
+
+class LibraryLock:
+    """
+    Non-blocking readers-writer lock over database.db and the uploads folder.
+
+    Backed by flock() on a lock file, so it holds across worker processes as
+    well as threads; each acquisition opens its own descriptor. Where fcntl
+    is unavailable (Windows) it falls back to in-process state, which is only
+    correct with a single worker.
+
+    Once an exclusive request has been refused, new shared holders are refused
+    for a while too, so a restore is not starved by a steady stream of downloads.
+    The claim is recorded as the mtime of a side file so every worker sees it.
+    """
+
+    def __init__(self, path, exclusive_claim_seconds=30):
+        self.path = path
+        self._claim_path = path + '.claim'
+        self._exclusive_claim_seconds = exclusive_claim_seconds
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shared = 0
+        self._exclusive = False
+
+    def _claimed(self):
+        try:
+            return time.time() - os.path.getmtime(self._claim_path) < self._exclusive_claim_seconds
+        except OSError:
+            return False
+
+    def _claim(self):
+        with open(self._claim_path, 'a'):
+            pass
+        os.utime(self._claim_path)
+
+    def _unclaim(self):
+        try:
+            os.remove(self._claim_path)
+        except OSError:
+            pass
+
+    def try_acquire(self, exclusive=False):
+        if not exclusive and self._claimed():
+            return False
+        if fcntl is None:
+            return self._try_acquire_local(exclusive)
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            if exclusive:
+                self._claim()
+            return False
+
+        if exclusive:
+            self._unclaim()
+        # Acquire and release always happen on the same request or GC thread
+        self._local.__dict__.setdefault('fds', []).append(fd)
+        return True
+
+    def release(self, exclusive=False):
+        if fcntl is None:
+            self._release_local(exclusive)
+            return
+        fd = self._local.fds.pop()
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def _try_acquire_local(self, exclusive):
+        with self._lock:
+            if self._exclusive:
+                return False
+            if exclusive:
+                if self._shared:
+                    self._claim()
+                    return False
+                self._exclusive = True
+                self._unclaim()
+                return True
+            self._shared += 1
+            return True
+
+    def _release_local(self, exclusive):
+        with self._lock:
+            if exclusive:
+                self._exclusive = False
+            else:
+                self._shared -= 1
+
+
+class AdmissionGate:
+    """
+    Concurrency limit plus bounded FIFO queue for one endpoint.
+
+    Args:
+        name (str): Endpoint name, used in messages
+        library_lock (LibraryLock): Lock taken for the duration of each admitted request
+        exclusive (bool): Take library_lock exclusively instead of shared
+        max_active (int): Requests allowed to run at the same time
+        max_queue (int): Tickets kept before new clients are turned away
+        retry_after (int): Seconds a queued client is told to wait before retrying
+    """
+
+    def __init__(self, name, library_lock, exclusive=False, max_active=1, max_queue=5, retry_after=5):
+        self.name = name
+        self.library_lock = library_lock
+        self.exclusive = exclusive
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        # A ticket is dropped if its client does not retry within a few retry periods
+        self.ticket_ttl = retry_after * 3
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queue = OrderedDict()  # client key -> last seen (monotonic)
+
+    def try_acquire(self, client_key):
+        """
+        Admit client_key if a slot is free and it is at the head of the queue.
+
+        Returns:
+            tuple: (admitted, queue position); position is None when the queue is full
+        """
+        with self._lock:
+            now = time.monotonic()
+            for key, last_seen in list(self._queue.items()):
+                if now - last_seen > self.ticket_ttl:
+                    del self._queue[key]
+
+            at_head = not self._queue or next(iter(self._queue)) == client_key
+            if self._active < self.max_active and at_head and self.library_lock.try_acquire(self.exclusive):
+                self._queue.pop(client_key, None)
+                self._active += 1
+                return True, 0
+
+            if client_key in self._queue:
+                self._queue[client_key] = now
+            elif len(self._queue) >= self.max_queue:
+                return False, None
+            else:
+                self._queue[client_key] = now
+            return False, list(self._queue).index(client_key) + 1
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+            self.library_lock.release(self.exclusive)
+
+    @contextmanager
+    def admit(self, client_key):
+        admitted, position = self.try_acquire(client_key)
+        if not admitted:
+            raise AdmissionDenied(self.name, position, self.retry_after)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class BuildCoalescer:
+    """
+    Share one in-flight build among all concurrent requests for the same key.
+
+    Only the first request (the leader) needs to pass the admission gate;
+    requests arriving while it builds simply wait for its result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def run(self, key, build, gate, client_key):
+        """
+        Return the result of build(), reusing an identical build already running.
+
+        Raises:
+            AdmissionDenied: If no build is running and the gate refuses this client
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                admitted, position = gate.try_acquire(client_key)
+                if not admitted:
+                    raise AdmissionDenied(gate.name, position, gate.retry_after)
+                future = Future()
+                self._in_flight[key] = future
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = build()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            gate.release()
@@ -1,38 +1,55 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify
 from flask_httpauth import HTTPBasicAuth
-from dotenv import load_dotenv
 import os
 import uuid
 import zipfile
 import io
 import hashlib
 import json
-import shutil
 import sqlite3
+import threading
+import time
 from datetime import datetime
+from functools import wraps
 from werkzeug.utils import secure_filename
-from database import init_database, create_song, get_all_songs, get_song_by_id, update_song, delete_song
-from midi_parser import parse_midi_tracks
+from database import DATABASE_FILE, init_database, create_song, get_all_songs, get_library_snapshot, get_song_by_id, update_song, delete_song, get_change_cursor, get_changes_since, get_sync_generation, new_sync_generation, purge_retired_blobs
+from midi_parser import parse_midi_tracks, compute_midi_fingerprint
+from similarity import SimilarityIndex, pack_fingerprint
+from settings import load_settings
+from admission import AdmissionDenied, AdmissionGate, BuildCoalescer, LibraryLock
 
-# Load environment variables
-load_dotenv()
+# Load environment variables once; heavy modules (mido, numpy) are imported on first use
+settings = load_settings()
 
 app = Flask(__name__)
 app.secret_key = 'sleepy-story-midi-sharing-secret-key'
 app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024  # 1MB max file size
 app.config['UPLOAD_FOLDER'] = os.path.join('static', 'uploads')
+app.config['BLOB_RETENTION_DAYS'] = settings.blob_retention_days
+app.config['BLOB_GC_INTERVAL'] = 3600  # seconds between retired file purges
+app.config['DUPLICATE_SIMILARITY'] = 0.96  # fingerprint similarity that triggers a duplicate warning
 
 # Initialize HTTP Basic Auth
 auth = HTTPBasicAuth()
 
-# Ensure upload directory exists
+# Ensure upload directory exists and the schema is current (one query when it already is)
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+init_database()
+
+similarity_index = SimilarityIndex(app.config['UPLOAD_FOLDER'])
+
+# Everything touching database.db or the uploads folder holds library_lock shared; restore
+# holds it exclusively. It is a file lock, so it also covers other worker processes.
+# Gate limits, queues and archive coalescing are per worker.
+library_lock = LibraryLock(f'{DATABASE_FILE}.lock')
+download_all_gate = AdmissionGate('download_all', library_lock, max_active=1, max_queue=5, retry_after=5)
+backup_gate = AdmissionGate('backup', library_lock, max_active=1, max_queue=5, retry_after=5)
+restore_gate = AdmissionGate('restore', library_lock, exclusive=True, max_active=1, max_queue=2, retry_after=10)
+archive_builds = BuildCoalescer()
 
 @auth.verify_password
 def verify_password(username, password):
-    auth_username = os.getenv('AUTH_USERNAME')
-    auth_password = os.getenv('AUTH_PASSWORD')
-    return username == auth_username and password == auth_password
+    return username == settings.auth_username and password == settings.auth_password
 
 def allowed_file(filename, file_type):
     if file_type == 'midi':
@@ -56,14 +73,86 @@ def save_uploaded_file(file, file_type):
         return unique_filename, filepath
     return None, None
 
+def fingerprint_and_find_duplicates(midi_filepath, exclude=None):
+    vector = compute_midi_fingerprint(midi_filepath)
+    if vector is None:
+        return pack_fingerprint(None), []
+    duplicates = similarity_index.search(vector, limit=3, min_score=app.config['DUPLICATE_SIMILARITY'],
+                                         exclude=exclude)
+    return pack_fingerprint(vector), duplicates
+
+def flash_duplicate_warning(duplicates):
+    if not duplicates:
+        return
+    songs = {song['id']: song for song in get_all_songs()}
+    names = [f"{songs[song_id]['face_id']:03d}{songs[song_id]['uploaded_by']} - {songs[song_id]['song_name']} ({score:.0%})"
+             for song_id, score in duplicates if song_id in songs]
+    if names:
+        flash('注意：可能与已有歌曲重复 - ' + '，'.join(names))
+
+FILE_EXTENSIONS = {'midi': 'mid', 'source': 'mscz', 'lyric': 'lrc'}
+
+def build_download_name(song, face_id, file_type):
+    artist_part = f" - {song['artist']}" if song['artist'] else ""
+    version_part = f" - v{song['version']}" if song['version'] else ""
+    return f"{face_id:03d}{song['uploaded_by']} - {song['song_name']}{artist_part}{version_part}.{FILE_EXTENSIONS[file_type]}"
+
+# Stored blobs are never rewritten in place, so a hash stays valid while mtime and size match
+_blob_hash_cache = {}
+
+def get_blob_hash(filepath):
+    stat = os.stat(filepath)
+    cached = _blob_hash_cache.get(filepath)
+    if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+        return cached[2]
+
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            sha256.update(chunk)
+    digest = sha256.hexdigest()
+    _blob_hash_cache[filepath] = (stat.st_mtime, stat.st_size, digest)
+    return digest
+
+def admission_client_key():
+    # Members share one login, so tell clients apart by address and browser
+    return f"{request.remote_addr}|{request.user_agent.string}"
+
+def uses_library(view):
+    # Non-blocking shared hold on the library; only a running (or pending) restore refuses it
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not library_lock.try_acquire():
+            raise AdmissionDenied('library', None, restore_gate.retry_after)
+        try:
+            return view(*args, **kwargs)
+        finally:
+            library_lock.release()
+    return wrapper
+
+@app.errorhandler(AdmissionDenied)
+def admission_denied(e):
+    if e.gate_name == 'library':
+        message = f'正在恢复数据，请 {e.retry_after} 秒后重试'
+        position = ''
+    elif e.position is None:
+        message = f'服务器繁忙，排队人数已满，请 {e.retry_after} 秒后重试'
+        position = ''
+    else:
+        message = f'服务器繁忙，您当前排在第 {e.position} 位，请 {e.retry_after} 秒后重试'
+        position = str(e.position)
+    return message, 429, {'Retry-After': str(e.retry_after), 'X-Queue-Position': position}
+
 @app.route('/')
 @auth.login_required
+@uses_library
 def index():
     songs = get_all_songs()
     return render_template('index.html', songs=songs)
 
 @app.route('/upload', methods=['GET', 'POST'])
 @auth.login_required
+@uses_library
 def upload():
     if request.method == 'POST':
         try:
@@ -99,6 +188,7 @@ def upload():
                 return render_template('upload.html')
 
             track_names = parse_midi_tracks(midi_filepath)
+            fingerprint, duplicates = fingerprint_and_find_duplicates(midi_filepath)
 
             # Save other files
             source_filename, _ = save_uploaded_file(source_file, 'source')
@@ -114,10 +204,13 @@ def upload():
                 midi_filename=midi_filename,
                 source_filename=source_filename,
                 lyric_filename=lyric_filename,
-                track_names=track_names
+                track_names=track_names,
+                changed_by=uploaded_by,  # members share one login, so record the role they acted as
+                fingerprint=fingerprint
             )
 
             flash(f'歌曲 "{song_name}" 上传成功')
+            flash_duplicate_warning(duplicates)
             return redirect(url_for('index'))
 
         except Exception as e:
@@ -128,6 +221,7 @@ def upload():
 
 @app.route('/edit/<song_id>', methods=['GET', 'POST'])
 @auth.login_required
+@uses_library
 def edit(song_id):
     song = get_song_by_id(song_id)
     if not song:
@@ -163,51 +257,31 @@ def edit(song_id):
 
             midi_filename = None
             track_names = None
+            fingerprint = None
+            duplicates = []
 
+            # Old files are not removed here; update_song retires them for later purging
             # Update MIDI file if provided
             if midi_file and midi_file.filename:
-                # Delete old MIDI file
-                if song['midi_filename']:
-                    old_path = os.path.join(app.config['UPLOAD_FOLDER'], song['midi_filename'])
-                    if os.path.exists(old_path):
-                        os.remove(old_path)
-
                 midi_filename, midi_filepath = save_uploaded_file(midi_file, 'midi')
                 if not midi_filename:
                     flash('MIDI文件格式不正确')
                     return render_template('upload.html', song=song)
                 track_names = parse_midi_tracks(midi_filepath)
+                fingerprint, duplicates = fingerprint_and_find_duplicates(midi_filepath, exclude=song_id)
 
             # Update source file if provided or handle deletion
             source_filename = None
             if delete_source and song['source_filename']:
-                # Delete existing source file
-                old_path = os.path.join(app.config['UPLOAD_FOLDER'], song['source_filename'])
-                if os.path.exists(old_path):
-                    os.remove(old_path)
                 source_filename = ''  # Set to empty string to clear from database
             elif source_file and source_file.filename:
-                # Replace with new source file
-                if song['source_filename']:
-                    old_path = os.path.join(app.config['UPLOAD_FOLDER'], song['source_filename'])
-                    if os.path.exists(old_path):
-                        os.remove(old_path)
                 source_filename, _ = save_uploaded_file(source_file, 'source')
 
             # Update lyric file if provided or handle deletion
             lyric_filename = None
             if delete_lyric and song['lyric_filename']:
-                # Delete existing lyric file
-                old_path = os.path.join(app.config['UPLOAD_FOLDER'], song['lyric_filename'])
-                if os.path.exists(old_path):
-                    os.remove(old_path)
                 lyric_filename = ''  # Set to empty string to clear from database
             elif lyric_file and lyric_file.filename:
-                # Replace with new lyric file
-                if song['lyric_filename']:
-                    old_path = os.path.join(app.config['UPLOAD_FOLDER'], song['lyric_filename'])
-                    if os.path.exists(old_path):
-                        os.remove(old_path)
                 lyric_filename, _ = save_uploaded_file(lyric_file, 'lyric')
 
             # Update song record
@@ -221,11 +295,14 @@ def edit(song_id):
                 midi_filename=midi_filename,
                 source_filename=source_filename,
                 lyric_filename=lyric_filename,
-                track_names=track_names
+                track_names=track_names,
+                changed_by=uploaded_by,  # members share one login, so record the role they acted as
+                fingerprint=fingerprint
             )
 
             if success:
                 flash(f'歌曲 "{song_name}" 更新成功')
+                flash_duplicate_warning(duplicates)
                 return redirect(url_for('index'))
             else:
                 flash('更新失败')
@@ -238,10 +315,12 @@ def edit(song_id):
 
 @app.route('/delete/<song_id>')
 @auth.login_required
+@uses_library
 def delete(song_id):
     song = get_song_by_id(song_id)
     if song:
-        success = delete_song(song_id)
+        # Deleting has no role field; record the client instead since the login is shared
+        success = delete_song(song_id, changed_by=admission_client_key())
         if success:
             flash(f'歌曲 "{song["song_name"]}" 删除成功')
         else:
@@ -251,8 +330,23 @@ def delete(song_id):
 
     return redirect(url_for('index'))
 
+@app.route('/similar/<song_id>')
+@auth.login_required
+@uses_library
+def similar(song_id):
+    song = get_song_by_id(song_id)
+    if not song:
+        flash('歌曲不存在')
+        return redirect(url_for('index'))
+
+    songs = {s['id']: s for s in get_all_songs()}
+    results = [(songs[similar_id], score) for similar_id, score in similarity_index.similar_to(song_id)
+               if similar_id in songs]
+    return render_template('similar.html', song=songs.get(song_id, song), results=results)
+
 @app.route('/download/<song_id>/<file_type>')
 @auth.login_required
+@uses_library
 def download_file(song_id, file_type):
     song = get_song_by_id(song_id)
     if not song:
@@ -279,66 +373,124 @@ def download_file(song_id, file_type):
     # Generate download filename based on specs
     songs = get_all_songs()
     face_id = next((s['face_id'] for s in songs if s['id'] == song_id), 1)
-
-    # Include artist if available
-    artist_part = f" - {song['artist']}" if song['artist'] else ""
-    version_part = f" - v{song['version']}" if song['version'] else ""
-
-    if file_type == 'midi':
-        download_name = f"{face_id:03d}{song['uploaded_by']} - {song['song_name']}{artist_part}{version_part}.mid"
-    elif file_type == 'source':
-        download_name = f"{face_id:03d}{song['uploaded_by']} - {song['song_name']}{artist_part}{version_part}.mscz"
-    elif file_type == 'lyric':
-        download_name = f"{face_id:03d}{song['uploaded_by']} - {song['song_name']}{artist_part}{version_part}.lrc"
+    download_name = build_download_name(song, face_id, file_type)
 
     return send_file(filepath, as_attachment=True, download_name=download_name)
 
 @app.route('/download_all')
 @auth.login_required
+@uses_library
 def download_all():
-    songs = get_all_songs()
+    cursor, songs = get_library_snapshot()
 
     if not songs:
         flash('没有歌曲可下载')
         return redirect(url_for('index'))
 
+    # Concurrent requests for the same library state share a single archive,
+    # built from exactly the songs the cursor describes
+    archive = archive_builds.run(('download_all', cursor), lambda: build_collection_archive(songs),
+                                 download_all_gate, admission_client_key())
+
+    # Generate ZIP filename
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    zip_filename = f"吃得好好睡得饱饱_MIDI合集_{timestamp}.zip"
+
+    return send_file(
+        io.BytesIO(archive),
+        mimetype='application/zip',
+        as_attachment=True,
+        download_name=zip_filename
+    )
+
+def build_collection_archive(songs):
     # Create ZIP file in memory
     memory_file = io.BytesIO()
 
     with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
         for song in songs:
             face_id = song['face_id']
-            role = song['uploaded_by']
-            song_name = song['song_name']
-            artist_part = f" - {song['artist']}" if song['artist'] else ""
-            version_part = f" - v{song['version']}" if song['version'] else ""
 
             # Add MIDI file
             if song['midi_filename']:
                 midi_path = os.path.join(app.config['UPLOAD_FOLDER'], song['midi_filename'])
                 if os.path.exists(midi_path):
-                    midi_name = f"{face_id:03d}{role} - {song_name}{artist_part}{version_part}.mid"
-                    zf.write(midi_path, midi_name)
+                    zf.write(midi_path, build_download_name(song, face_id, 'midi'))
 
             # Add lyric file if exists
             if song['lyric_filename']:
                 lyric_path = os.path.join(app.config['UPLOAD_FOLDER'], song['lyric_filename'])
                 if os.path.exists(lyric_path):
-                    lyric_name = f"{face_id:03d}{role} - {song_name}{artist_part}{version_part}.lrc"
-                    zf.write(lyric_path, lyric_name)
-
-    memory_file.seek(0)
-
-    # Generate ZIP filename
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    zip_filename = f"吃得好好睡得饱饱_MIDI合集_{timestamp}.zip"
-
-    return send_file(
-        memory_file,
-        mimetype='application/zip',
-        as_attachment=True,
-        download_name=zip_filename
-    )
+                    zf.write(lyric_path, build_download_name(song, face_id, 'lyric'))
+
+    return memory_file.getvalue()
+
+def build_sync_entries(songs):
+    # Mirror the same files /download_all ships: MIDI plus lyric when present
+    entries = []
+    for song in songs:
+        for file_type in ['midi', 'lyric']:
+            filename = song[f'{file_type}_filename']
+            if not filename:
+                continue
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            if not os.path.exists(filepath):
+                continue
+            entries.append({
+                'song_id': song['id'],
+                'face_id': song['face_id'],
+                'file_type': file_type,
+                'name': build_download_name(song, song['face_id'], file_type),
+                'sha256': get_blob_hash(filepath),
+                'size': os.path.getsize(filepath),
+                'mtime': os.path.getmtime(filepath),
+                'url': url_for('download_file', song_id=song['id'], file_type=file_type)
+            })
+    return entries
+
+@app.route('/api/sync/manifest')
+@auth.login_required
+@uses_library
+def sync_manifest():
+    # Read the cursor first so anything changed while building is replayed by the next /changes call
+    generation = get_sync_generation()
+    cursor = get_change_cursor()
+    return jsonify({
+        'generation': generation,
+        'cursor': cursor,
+        'entries': build_sync_entries(get_all_songs())
+    })
+
+@app.route('/api/sync/changes')
+@auth.login_required
+@uses_library
+def sync_changes():
+    since = request.args.get('since', 0, type=int)
+    generation = get_sync_generation()
+
+    # Cursors from another generation (restored or recreated database) are meaningless; start over
+    current_cursor = get_change_cursor()
+    if request.args.get('generation') != generation or since > current_cursor:
+        return jsonify({
+            'generation': generation,
+            'cursor': current_cursor,
+            'reset': True,
+            'entries': build_sync_entries(get_all_songs()),
+            'changed': [],
+            'deleted': []
+        })
+
+    # Songs are read after the log so they are at least as new as the returned cursor
+    cursor, changed, deleted = get_changes_since(since)
+    songs = [song for song in get_all_songs() if song['id'] in changed]
+    return jsonify({
+        'generation': generation,
+        'cursor': cursor,
+        'reset': False,
+        'entries': build_sync_entries(songs),
+        'changed': sorted(changed),
+        'deleted': sorted(deleted)
+    })
 
 @app.route('/backup-restore')
 @auth.login_required
@@ -347,50 +499,63 @@ def backup_restore():
 
 @app.route('/backup')
 @auth.login_required
+@uses_library
 def backup():
     try:
-        # Create backup ZIP file in memory
-        memory_file = io.BytesIO()
-
-        with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-            # Add database file
-            if os.path.exists('database.db'):
-                zf.write('database.db', 'database.db')
-
-            # Add all files from uploads directory
-            upload_dir = app.config['UPLOAD_FOLDER']
-            if os.path.exists(upload_dir):
-                for filename in os.listdir(upload_dir):
-                    file_path = os.path.join(upload_dir, filename)
-                    if os.path.isfile(file_path) and filename != '.gitkeep':
-                        zf.write(file_path, f"uploads/{filename}")
-
-            # Add backup metadata
-            songs = get_all_songs()
-            backup_info = {
-                "backup_date": datetime.now().isoformat(),
-                "song_count": len(songs),
-                "app_version": "1.0"
-            }
-            zf.writestr("backup_info.json", json.dumps(backup_info, ensure_ascii=False, indent=2))
-
-        memory_file.seek(0)
+        # Concurrent requests for the same library state share a single archive; the
+        # cursor is read before the build starts, so the archive is never older than it
+        archive = archive_builds.run(('backup', get_change_cursor()), build_backup_archive,
+                                     backup_gate, admission_client_key())
 
         # Generate backup filename
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         backup_filename = f"sleepy_backup_{timestamp}.zip"
 
         return send_file(
-            memory_file,
+            io.BytesIO(archive),
             mimetype='application/zip',
             as_attachment=True,
             download_name=backup_filename
         )
 
+    except AdmissionDenied:
+        raise
     except Exception as e:
         flash(f'备份失败: {str(e)}')
         return redirect(url_for('backup_restore'))
 
+def build_backup_archive():
+    # Create backup ZIP file in memory
+    memory_file = io.BytesIO()
+
+    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
+        # Add database file
+        if os.path.exists('database.db'):
+            zf.write('database.db', 'database.db')
+
+        # Add all files from uploads directory
+        upload_dir = app.config['UPLOAD_FOLDER']
+        if os.path.exists(upload_dir):
+            for filename in os.listdir(upload_dir):
+                file_path = os.path.join(upload_dir, filename)
+                if os.path.isfile(file_path) and filename != '.gitkeep':
+                    try:
+                        zf.write(file_path, f"uploads/{filename}")
+                    except FileNotFoundError:
+                        # Retired file purged by the GC thread after listdir; nothing references it
+                        continue
+
+        # Add backup metadata
+        songs = get_all_songs()
+        backup_info = {
+            "backup_date": datetime.now().isoformat(),
+            "song_count": len(songs),
+            "app_version": "1.0"
+        }
+        zf.writestr("backup_info.json", json.dumps(backup_info, ensure_ascii=False, indent=2))
+
+    return memory_file.getvalue()
+
 @app.route('/restore', methods=['POST'])
 @auth.login_required
 def restore():
@@ -408,93 +573,129 @@ def restore():
         flash('请确认恢复操作')
         return redirect(url_for('backup_restore'))
 
-    try:
-        # Save uploaded file temporarily
-        temp_backup_path = os.path.join(app.config['UPLOAD_FOLDER'], 'temp_backup.zip')
-        backup_file.save(temp_backup_path)
-
-        # Validate backup file
-        with zipfile.ZipFile(temp_backup_path, 'r') as zf:
-            file_list = zf.namelist()
-
-            # Check if database.db exists in backup
-            if 'database.db' not in file_list:
-                flash('无效的备份文件：缺少数据库文件')
-                os.remove(temp_backup_path)
-                return redirect(url_for('backup_restore'))
-
-            # Test if database file is valid
-            try:
-                db_data = zf.read('database.db')
-                temp_db_path = 'temp_test.db'
-                with open(temp_db_path, 'wb') as f:
-                    f.write(db_data)
-
-                # Test database connection
-                conn = sqlite3.connect(temp_db_path)
-                conn.execute('SELECT COUNT(*) FROM songs')
-                conn.close()
-                os.remove(temp_db_path)
-
-            except Exception as e:
-                flash(f'无效的备份文件：数据库文件损坏 - {str(e)}')
-                os.remove(temp_backup_path)
-                return redirect(url_for('backup_restore'))
-
-        # Backup current data before restore (safety backup)
-        safety_backup_path = f"safety_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-        if os.path.exists('database.db'):
-            with zipfile.ZipFile(safety_backup_path, 'w', zipfile.ZIP_DEFLATED) as safety_zf:
-                safety_zf.write('database.db', 'database.db')
-                upload_dir = app.config['UPLOAD_FOLDER']
-                if os.path.exists(upload_dir):
-                    for filename in os.listdir(upload_dir):
-                        file_path = os.path.join(upload_dir, filename)
-                        if os.path.isfile(file_path) and filename not in ['temp_backup.zip', '.gitkeep']:
-                            safety_zf.write(file_path, f"uploads/{filename}")
-
-        # Clear existing data
-        if os.path.exists('database.db'):
-            os.remove('database.db')
+    # Restore replaces database.db and the uploads folder, so nothing else may run meanwhile
+    with restore_gate.admit(admission_client_key()):
+        try:
+            # Save uploaded file temporarily
+            temp_backup_path = os.path.join(app.config['UPLOAD_FOLDER'], 'temp_backup.zip')
+            backup_file.save(temp_backup_path)
+
+            # Validate backup file
+            with zipfile.ZipFile(temp_backup_path, 'r') as zf:
+                file_list = zf.namelist()
+
+                # Check if database.db exists in backup
+                if 'database.db' not in file_list:
+                    flash('无效的备份文件：缺少数据库文件')
+                    os.remove(temp_backup_path)
+                    return redirect(url_for('backup_restore'))
+
+                # Test if database file is valid
+                try:
+                    db_data = zf.read('database.db')
+                    temp_db_path = 'temp_test.db'
+                    with open(temp_db_path, 'wb') as f:
+                        f.write(db_data)
+
+                    # Test database connection
+                    conn = sqlite3.connect(temp_db_path)
+                    conn.execute('SELECT COUNT(*) FROM songs')
+                    conn.close()
+                    os.remove(temp_db_path)
+
+                except Exception as e:
+                    flash(f'无效的备份文件：数据库文件损坏 - {str(e)}')
+                    os.remove(temp_backup_path)
+                    return redirect(url_for('backup_restore'))
+
+            # Backup current data before restore (safety backup)
+            safety_backup_path = f"safety_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+            if os.path.exists('database.db'):
+                with zipfile.ZipFile(safety_backup_path, 'w', zipfile.ZIP_DEFLATED) as safety_zf:
+                    safety_zf.write('database.db', 'database.db')
+                    upload_dir = app.config['UPLOAD_FOLDER']
+                    if os.path.exists(upload_dir):
+                        for filename in os.listdir(upload_dir):
+                            file_path = os.path.join(upload_dir, filename)
+                            if os.path.isfile(file_path) and filename not in ['temp_backup.zip', '.gitkeep']:
+                                safety_zf.write(file_path, f"uploads/{filename}")
+
+            # Clear existing data
+            if os.path.exists('database.db'):
+                os.remove('database.db')
 
-        # Clear uploads directory (except .gitkeep)
-        upload_dir = app.config['UPLOAD_FOLDER']
-        if os.path.exists(upload_dir):
-            for filename in os.listdir(upload_dir):
-                if filename not in ['temp_backup.zip', '.gitkeep']:
-                    file_path = os.path.join(upload_dir, filename)
-                    if os.path.isfile(file_path):
-                        os.remove(file_path)
-
-        # Extract backup
-        with zipfile.ZipFile(temp_backup_path, 'r') as zf:
-            # Extract database
-            if 'database.db' in zf.namelist():
-                with open('database.db', 'wb') as f:
-                    f.write(zf.read('database.db'))
-
-            # Extract upload files
-            for file_info in zf.filelist:
-                if file_info.filename.startswith('uploads/') and not file_info.is_dir():
-                    filename = os.path.basename(file_info.filename)
-                    if filename:
+            # Clear uploads directory (except .gitkeep)
+            upload_dir = app.config['UPLOAD_FOLDER']
+            if os.path.exists(upload_dir):
+                for filename in os.listdir(upload_dir):
+                    if filename not in ['temp_backup.zip', '.gitkeep']:
                         file_path = os.path.join(upload_dir, filename)
-                        with open(file_path, 'wb') as f:
-                            f.write(zf.read(file_info.filename))
+                        if os.path.isfile(file_path):
+                            os.remove(file_path)
+
+            # Extract backup
+            with zipfile.ZipFile(temp_backup_path, 'r') as zf:
+                # Extract database
+                if 'database.db' in zf.namelist():
+                    with open('database.db', 'wb') as f:
+                        f.write(zf.read('database.db'))
+
+                # Extract upload files
+                for file_info in zf.filelist:
+                    if file_info.filename.startswith('uploads/') and not file_info.is_dir():
+                        filename = os.path.basename(file_info.filename)
+                        if filename:
+                            file_path = os.path.join(upload_dir, filename)
+                            with open(file_path, 'wb') as f:
+                                f.write(zf.read(file_info.filename))
+
+            # Clean up
+            os.remove(temp_backup_path)
 
-        # Clean up
-        os.remove(temp_backup_path)
+            # Backups from older versions may predate the current schema
+            init_database()
+            # The restored change log may reuse cursors clients have already seen
+            new_sync_generation()
+            similarity_index.invalidate()
 
-        flash(f'数据恢复成功！安全备份已保存为: {safety_backup_path}')
-        return redirect(url_for('index'))
+            flash(f'数据恢复成功！安全备份已保存为: {safety_backup_path}')
+            return redirect(url_for('index'))
 
-    except Exception as e:
-        flash(f'恢复失败: {str(e)}')
-        # Clean up temp file if it exists
-        if os.path.exists(temp_backup_path):
-            os.remove(temp_backup_path)
-        return redirect(url_for('backup_restore'))
+        except Exception as e:
+            flash(f'恢复失败: {str(e)}')
+            # Clean up temp file if it exists
+            if os.path.exists(temp_backup_path):
+                os.remove(temp_backup_path)
+            return redirect(url_for('backup_restore'))
+
+_blob_gc_started = False
+_blob_gc_start_lock = threading.Lock()
+
+@app.before_request
+def start_blob_gc():
+    # Started by the first request so it runs once in the serving process under any
+    # WSGI host, and never in the debug reloader's parent process
+    global _blob_gc_started
+    if _blob_gc_started:
+        return
+    with _blob_gc_start_lock:
+        if _blob_gc_started:
+            return
+        _blob_gc_started = True
+
+    def run():
+        while True:
+            # Skip this round rather than touch the uploads folder during a restore
+            if library_lock.try_acquire():
+                try:
+                    purge_retired_blobs(app.config['BLOB_RETENTION_DAYS'])
+                except Exception as e:
+                    print(f"Error purging retired files: {e}")
+                finally:
+                    library_lock.release()
+            time.sleep(app.config['BLOB_GC_INTERVAL'])
+
+    threading.Thread(target=run, name='blob-gc', daemon=True).start()
 
 if __name__ == '__main__':
-    init_database()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""
+Cold-start benchmark for the app module.
+
+Each run imports app in a fresh interpreter, the same as a worker respawn,
+and reports the import time. It also checks that the heavy modules are
+still loaded lazily. Runs happen in a scratch directory so the database
+and uploads folder the app creates on import do not touch the real ones.
+
+Usage:
+    python bench_startup.py [--runs 10] [--budget-ms 300]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that must not be imported just by loading the app.
+# dotenv is expected whenever a .env supplies the credentials.
+LAZY_MODULES = ['mido', 'numpy']
+if not os.path.exists(os.path.join(APP_DIR, '.env')):
+    LAZY_MODULES.append('dotenv')
+
+PROBE = f"""
+import json, sys, time
+sys.path.insert(0, {APP_DIR!r})
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    'import_ms': elapsed * 1000,
+    'loaded': [name for name in {LAZY_MODULES!r} if name in sys.modules]
+}}))
+"""
+
+
+def run_once(workdir):
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=workdir,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='测量应用冷启动时间')
+    parser.add_argument('--runs', type=int, default=10, help='运行次数')
+    parser.add_argument('--budget-ms', type=float, default=300, help='导入时间中位数上限 (毫秒)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # The first run warms the OS file cache, compiles .pyc files and creates the schema; it is not counted
+        run_once(workdir)
+        results = [run_once(workdir) for _ in range(args.runs)]
+    timings = sorted(result['import_ms'] for result in results)
+    eagerly_loaded = sorted({name for result in results for name in result['loaded']})
+
+    median = statistics.median(timings)
+    print(f"import app: median {median:.1f} ms, min {timings[0]:.1f} ms, max {timings[-1]:.1f} ms ({args.runs} runs)")
+
+    failed = False
+    if eagerly_loaded:
+        print(f"eagerly imported: {', '.join(eagerly_loaded)}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"over budget: {median:.1f} ms > {args.budget_ms:.0f} ms")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
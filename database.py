@@ -1,18 +1,49 @@
 import sqlite3
 import uuid
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 
 DATABASE_FILE = 'database.db'
+UPLOAD_FOLDER = os.path.join('static', 'uploads')
 
 def get_db_connection():
     conn = sqlite3.connect(DATABASE_FILE)
     conn.row_factory = sqlite3.Row
     return conn
 
-def init_database():
-    conn = get_db_connection()
+def _log_change(conn, song_id, action, song_uploaded_at, changed_by=None, old_song=None, old_blobs=()):
+    # Written on the caller's connection so the entry commits together with the change
+    changed_at = datetime.now()
+    old_blobs = sorted(set(filename for filename in old_blobs if filename))
+    cursor = conn.execute('''
+        INSERT INTO change_log (song_id, action, song_uploaded_at, changed_at, changed_by, old_data, old_blobs)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (song_id, action, song_uploaded_at, changed_at, changed_by,
+          json.dumps(dict(old_song), ensure_ascii=False) if old_song else None,
+          json.dumps(old_blobs) if old_blobs else None))
+
+    # Replaced files stay on disk until purge_retired_blobs() collects them
+    conn.executemany('''
+        INSERT OR REPLACE INTO retired_blobs (filename, change_seq, retired_at)
+        VALUES (?, ?, ?)
+    ''', [(filename, cursor.lastrowid, changed_at) for filename in old_blobs])
+
+def _store_fingerprint(conn, song_id, fingerprint):
+    # fingerprint is a (version, packed float32 bytes) pair from similarity.pack_fingerprint;
+    # empty bytes mark a song that has no usable fingerprint
+    version, vector = fingerprint
+    conn.execute('''
+        INSERT OR REPLACE INTO song_fingerprints (song_id, version, vector) VALUES (?, ?, ?)
+    ''', (song_id, version, vector))
+
+def _ensure_columns(conn, table, columns):
+    existing = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+    for name, column_type in columns:
+        if name not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+
+def _migrate_songs(conn):
     conn.execute('''
         CREATE TABLE IF NOT EXISTS songs (
             id TEXT PRIMARY KEY,
@@ -28,20 +59,102 @@ def init_database():
             track_names TEXT
         )
     ''')
-    conn.commit()
+
+def _migrate_change_log(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            song_id TEXT NOT NULL,
+            action TEXT NOT NULL,
+            song_uploaded_at TIMESTAMP,
+            changed_at TIMESTAMP NOT NULL,
+            changed_by TEXT,
+            old_data TEXT,
+            old_blobs TEXT
+        )
+    ''')
+    _ensure_columns(conn, 'change_log', [('changed_by', 'TEXT'), ('old_data', 'TEXT'), ('old_blobs', 'TEXT')])
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS retired_blobs (
+            filename TEXT PRIMARY KEY,
+            change_seq INTEGER NOT NULL,
+            retired_at TIMESTAMP NOT NULL
+        )
+    ''')
+
+def _migrate_fingerprints(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS song_fingerprints (
+            song_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            vector BLOB NOT NULL
+        )
+    ''')
+
+def _migrate_meta(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+
+# Applied in order; the database's PRAGMA user_version records how many have run.
+# Append new migrations, never edit or reorder existing ones. The early ones use
+# IF NOT EXISTS because databases from before versioning report version 0.
+MIGRATIONS = [
+    _migrate_songs,
+    _migrate_change_log,
+    _migrate_fingerprints,
+    _migrate_meta,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def init_database():
+    """
+    Bring the database schema up to SCHEMA_VERSION.
+
+    An up-to-date database costs a single PRAGMA query, so this is safe to
+    call on every startup.
+    """
+    conn = get_db_connection()
+    current_version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if current_version >= SCHEMA_VERSION:
+        conn.close()
+        return
+
+    # sqlite3 does not open transactions for DDL on its own; do it explicitly.
+    # IMMEDIATE takes the write lock up front, so when several workers start at
+    # once the others wait here and then see the version the first one wrote.
+    conn.isolation_level = None
+    conn.execute('BEGIN IMMEDIATE')
+    current_version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if current_version >= SCHEMA_VERSION:
+        conn.execute('ROLLBACK')
+        conn.close()
+        return
+
+    for migration in MIGRATIONS[current_version:]:
+        migration(conn)
+    conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    conn.execute('COMMIT')
     conn.close()
 
-def create_song(song_name, artist, version, notes, uploaded_by, midi_filename, source_filename, lyric_filename, track_names):
+def create_song(song_name, artist, version, notes, uploaded_by, midi_filename, source_filename, lyric_filename, track_names, changed_by=None, fingerprint=None):
     conn = get_db_connection()
     song_id = str(uuid.uuid4())
+    uploaded_at = datetime.now()
     track_names_json = json.dumps(track_names) if track_names else None
 
     conn.execute('''
         INSERT INTO songs (id, song_name, artist, version, notes, uploaded_by, uploaded_at,
                           midi_filename, source_filename, lyric_filename, track_names)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (song_id, song_name, artist, version, notes, uploaded_by, datetime.now(),
+    ''', (song_id, song_name, artist, version, notes, uploaded_by, uploaded_at,
           midi_filename, source_filename, lyric_filename, track_names_json))
+    _log_change(conn, song_id, 'create', uploaded_at, changed_by)
+    if fingerprint is not None:
+        _store_fingerprint(conn, song_id, fingerprint)
 
     conn.commit()
     conn.close()
@@ -53,7 +166,29 @@ def get_all_songs():
         SELECT * FROM songs ORDER BY uploaded_at ASC
     ''').fetchall()
     conn.close()
+    return _songs_with_face_ids(songs)
+
+def get_library_snapshot():
+    """
+    Read the change_log cursor and the song list as one consistent state.
+
+    Both queries run in a single read transaction, so the songs are exactly
+    the library the cursor describes even while uploads are committing.
+
+    Returns:
+        tuple: (change_log cursor, list of songs as returned by get_all_songs)
+    """
+    conn = get_db_connection()
+    conn.execute('BEGIN')
+    row = conn.execute('SELECT MAX(seq) FROM change_log').fetchone()
+    songs = conn.execute('''
+        SELECT * FROM songs ORDER BY uploaded_at ASC
+    ''').fetchall()
+    conn.rollback()
+    conn.close()
+    return row[0] or 0, _songs_with_face_ids(songs)
 
+def _songs_with_face_ids(songs):
     # Add face_id based on upload order
     songs_list = []
     for i, song in enumerate(songs, 1):
@@ -77,8 +212,9 @@ def get_song_by_id(song_id):
         return song_dict
     return None
 
-def update_song(song_id, song_name, artist, version, notes, uploaded_by, midi_filename=None, source_filename=None, lyric_filename=None, track_names=None):
+def update_song(song_id, song_name, artist, version, notes, uploaded_by, midi_filename=None, source_filename=None, lyric_filename=None, track_names=None, changed_by=None, fingerprint=None):
     conn = get_db_connection()
+    midi_replaced = midi_filename is not None
 
     # Get current song data
     current_song = conn.execute('SELECT * FROM songs WHERE id = ?', (song_id,)).fetchone()
@@ -104,27 +240,160 @@ def update_song(song_id, song_name, artist, version, notes, uploaded_by, midi_fi
         WHERE id = ?
     ''', (song_name, artist, version, notes, uploaded_by, midi_filename, source_filename, lyric_filename, track_names_json, song_id))
 
+    # Any file no longer referenced by the row is retired rather than deleted
+    new_filenames = {midi_filename, source_filename, lyric_filename}
+    old_blobs = [current_song[column] for column in ['midi_filename', 'source_filename', 'lyric_filename']
+                 if current_song[column] not in new_filenames]
+    _log_change(conn, song_id, 'update', current_song['uploaded_at'], changed_by, current_song, old_blobs)
+    if fingerprint is not None:
+        _store_fingerprint(conn, song_id, fingerprint)
+    elif midi_replaced:
+        # The old fingerprint describes a file that is gone
+        conn.execute('DELETE FROM song_fingerprints WHERE song_id = ?', (song_id,))
+
     conn.commit()
     conn.close()
     return True
 
-def delete_song(song_id):
+def delete_song(song_id, changed_by=None):
     conn = get_db_connection()
     song = conn.execute('SELECT * FROM songs WHERE id = ?', (song_id,)).fetchone()
 
     if song:
-        # Delete associated files
-        for filename in [song['midi_filename'], song['source_filename'], song['lyric_filename']]:
-            if filename:
-                file_path = os.path.join('static', 'uploads', filename)
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-
-        # Delete from database
+        # Delete from database; associated files are retired and purged later
         conn.execute('DELETE FROM songs WHERE id = ?', (song_id,))
+        conn.execute('DELETE FROM song_fingerprints WHERE song_id = ?', (song_id,))
+        _log_change(conn, song_id, 'delete', song['uploaded_at'], changed_by, song,
+                    [song['midi_filename'], song['source_filename'], song['lyric_filename']])
         conn.commit()
         conn.close()
         return True
 
     conn.close()
-    return False
\ No newline at end of file
+    return False
+
+def get_fingerprints(version):
+    """
+    Load stored fingerprints of the given version for songs that still exist.
+
+    Returns:
+        dict: song id -> packed float32 bytes (empty for songs that cannot be fingerprinted)
+    """
+    conn = get_db_connection()
+    rows = conn.execute('''
+        SELECT f.song_id, f.vector FROM song_fingerprints f
+        JOIN songs s ON s.id = f.song_id
+        WHERE f.version = ?
+    ''', (version,)).fetchall()
+    conn.close()
+    return {row['song_id']: row['vector'] for row in rows}
+
+def save_fingerprint(song_id, fingerprint):
+    conn = get_db_connection()
+    _store_fingerprint(conn, song_id, fingerprint)
+    conn.commit()
+    conn.close()
+
+def get_sync_generation():
+    """
+    Return the token identifying this copy of the change log.
+
+    Sync cursors are only comparable within one generation; a restore starts
+    a new one so clients holding old cursors fall back to a full resync.
+    """
+    conn = get_db_connection()
+    row = conn.execute('SELECT value FROM meta WHERE key = ?', ('sync_generation',)).fetchone()
+    conn.close()
+    if row:
+        return row['value']
+    return new_sync_generation()
+
+def new_sync_generation():
+    conn = get_db_connection()
+    generation = uuid.uuid4().hex
+    conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('sync_generation', generation))
+    conn.commit()
+    conn.close()
+    return generation
+
+def get_change_cursor():
+    conn = get_db_connection()
+    row = conn.execute('SELECT MAX(seq) FROM change_log').fetchone()
+    conn.close()
+    return row[0] or 0
+
+def get_changes_since(cursor):
+    """
+    Collect the songs touched after the given change_log cursor.
+
+    Deleting a song shifts the face_id of every song uploaded after it, so those
+    songs are reported as changed as well even though their rows are untouched.
+
+    Args:
+        cursor (int): Last change_log seq the caller has already seen
+
+    Returns:
+        tuple: (new cursor, set of changed song ids, set of deleted song ids)
+    """
+    conn = get_db_connection()
+    rows = conn.execute('''
+        SELECT seq, song_id, action, song_uploaded_at FROM change_log
+        WHERE seq > ? ORDER BY seq ASC
+    ''', (cursor,)).fetchall()
+
+    new_cursor = cursor
+    latest_action = {}
+    earliest_deleted_at = None
+    for row in rows:
+        new_cursor = row['seq']
+        latest_action[row['song_id']] = row['action']
+        if row['action'] == 'delete' and row['song_uploaded_at'] is not None:
+            if earliest_deleted_at is None or row['song_uploaded_at'] < earliest_deleted_at:
+                earliest_deleted_at = row['song_uploaded_at']
+
+    changed = {song_id for song_id, action in latest_action.items() if action != 'delete'}
+    deleted = {song_id for song_id, action in latest_action.items() if action == 'delete'}
+
+    if earliest_deleted_at is not None:
+        renumbered = conn.execute('SELECT id FROM songs WHERE uploaded_at > ?',
+                                  (earliest_deleted_at,)).fetchall()
+        changed.update(row['id'] for row in renumbered)
+
+    conn.close()
+    return new_cursor, changed, deleted
+
+def purge_retired_blobs(retention_days):
+    """
+    Remove retired upload files older than the retention period.
+
+    Files that are referenced by a song again (e.g. after an undo) are kept.
+
+    Args:
+        retention_days (float): How long retired files are kept
+
+    Returns:
+        int: Number of files removed from disk
+    """
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    conn = get_db_connection()
+    expired = [row['filename'] for row in conn.execute(
+        'SELECT filename FROM retired_blobs WHERE retired_at < ?', (cutoff,))]
+    if not expired:
+        conn.close()
+        return 0
+
+    referenced = set()
+    for row in conn.execute('SELECT midi_filename, source_filename, lyric_filename FROM songs'):
+        referenced.update(row)
+
+    removed = 0
+    for filename in expired:
+        file_path = os.path.join(UPLOAD_FOLDER, filename)
+        if filename not in referenced and os.path.exists(file_path):
+            os.remove(file_path)
+            removed += 1
+
+    conn.executemany('DELETE FROM retired_blobs WHERE filename = ?', [(filename,) for filename in expired])
+    conn.commit()
+    conn.close()
+    return removed
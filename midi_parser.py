@@ -1,9 +1,20 @@
 """
 MIDI file parsing utilities for track name extraction and analysis.
 Handles Unicode encoding issues and provides clean track information.
+
+mido and numpy are imported inside the functions that need them so importing
+this module stays cheap at application startup.
 """
 
-import mido
+# Bump when the feature layout changes so stored fingerprints are recomputed
+FINGERPRINT_VERSION = 3
+_INTERVAL_RANGE = 12
+_INTERVAL_BINS = 2 * _INTERVAL_RANGE + 1
+_BIGRAM_BUCKETS = 64
+# Tempo is log2(bpm / 120) clipped to one octave either way and scaled down,
+# so a re-upload at another tempo never drops more than ~2.6% in similarity
+_TEMPO_WEIGHT = 0.2
+FINGERPRINT_SIZE = 12 + _INTERVAL_BINS + _BIGRAM_BUCKETS + 1
 
 
 def parse_midi_tracks(filepath):
@@ -17,6 +28,8 @@ def parse_midi_tracks(filepath):
     Returns:
         list: List of track names from musical tracks
     """
+    import mido
+
     try:
         mid = mido.MidiFile(filepath)
         track_names = []
@@ -112,6 +125,8 @@ def get_midi_info(filepath):
     Returns:
         dict: Dictionary containing MIDI file information
     """
+    import mido
+
     try:
         mid = mido.MidiFile(filepath)
 
@@ -131,4 +146,77 @@ def get_midi_info(filepath):
             'ticks_per_beat': 0,
             'length': 0,
             'track_names': []
-        }
\ No newline at end of file
+        }
+
+
+def compute_midi_fingerprint(filepath):
+    """
+    Compute a compact feature vector describing the music in a MIDI file.
+
+    The vector concatenates a pitch-class histogram, a melodic interval
+    histogram, hashed interval bigrams and a lightly weighted initial tempo. It is
+    L2-normalised, so the dot product of two fingerprints is their cosine similarity.
+
+    Args:
+        filepath (str): Path to the MIDI file
+
+    Returns:
+        numpy.ndarray: float32 vector of FINGERPRINT_SIZE, or None if the file has no notes
+    """
+    import mido
+    import numpy as np
+
+    try:
+        mid = mido.MidiFile(filepath)
+    except Exception as e:
+        print(f"Error computing fingerprint for {filepath}: {e}")
+        return None
+
+    pitch_classes = np.zeros(12, dtype=np.float32)
+    intervals = np.zeros(_INTERVAL_BINS, dtype=np.float32)
+    bigrams = np.zeros(_BIGRAM_BUCKETS, dtype=np.float32)
+    tempo = None
+
+    for track in mid.tracks:
+        # Intervals are melodic only within one voice, so follow each channel separately
+        previous_note = {}
+        previous_interval = {}
+        for msg in track:
+            if msg.type == 'set_tempo' and tempo is None:
+                tempo = msg.tempo
+            # Channel 10 (index 9) is percussion; its note numbers are not pitches
+            if msg.type != 'note_on' or msg.velocity == 0 or msg.channel == 9:
+                continue
+
+            pitch_classes[msg.note % 12] += 1
+            channel = msg.channel
+            if channel in previous_note:
+                interval = max(-_INTERVAL_RANGE, min(_INTERVAL_RANGE, msg.note - previous_note[channel]))
+                intervals[interval + _INTERVAL_RANGE] += 1
+                if channel in previous_interval:
+                    bucket = ((previous_interval[channel] + _INTERVAL_RANGE) * _INTERVAL_BINS
+                              + interval + _INTERVAL_RANGE) % _BIGRAM_BUCKETS
+                    bigrams[bucket] += 1
+                previous_interval[channel] = interval
+            previous_note[channel] = msg.note
+
+    if not pitch_classes.any():
+        return None
+
+    bpm = mido.tempo2bpm(tempo if tempo is not None else 500000)
+    tempo_feature = np.array([_TEMPO_WEIGHT * np.clip(np.log2(bpm / 120.0), -1.0, 1.0)], dtype=np.float32)
+
+    vector = np.concatenate([
+        _normalize(pitch_classes),
+        _normalize(intervals),
+        _normalize(bigrams),
+        tempo_feature
+    ])
+    return _normalize(vector)
+
+
+def _normalize(vector):
+    import numpy as np
+
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
@@ -0,0 +1,33 @@
+"""
+Application settings, read once from the environment (and .env) at startup.
+"""
+
+import os
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Settings:
+    auth_username: str
+    auth_password: str
+    blob_retention_days: float
+
+
+def load_settings():
+    """
+    Load settings from environment variables, reading .env first if present.
+
+    Returns:
+        Settings: Immutable settings for the lifetime of the process
+    """
+    # python-dotenv is slow to import, so only load it when there is a .env to read
+    env_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
+    if os.path.exists(env_path):
+        from dotenv import load_dotenv
+        load_dotenv(env_path)
+
+    return Settings(
+        auth_username=os.getenv('AUTH_USERNAME'),
+        auth_password=os.getenv('AUTH_PASSWORD'),
+        blob_retention_days=float(os.getenv('BLOB_RETENTION_DAYS', '30'))
+    )
@@ -0,0 +1,117 @@
+"""
+Nearest-neighbour search over MIDI fingerprints.
+Used to list similar songs and to warn about likely duplicate uploads.
+"""
+
+import os
+import threading
+
+from database import get_all_songs, get_change_cursor, get_fingerprints, get_sync_generation, save_fingerprint
+from midi_parser import FINGERPRINT_VERSION, FINGERPRINT_SIZE, compute_midi_fingerprint
+
+
+def pack_fingerprint(vector):
+    """
+    Pack a fingerprint vector for storage alongside its feature version.
+
+    A None vector (no notes or unreadable file) packs to empty bytes. The
+    stored marker keeps the song out of the index without re-parsing it.
+
+    Args:
+        vector (numpy.ndarray): Output of compute_midi_fingerprint, or None
+
+    Returns:
+        tuple: (version, float32 bytes) as accepted by create_song/update_song
+    """
+    import numpy as np
+
+    if vector is None:
+        return FINGERPRINT_VERSION, b''
+    return FINGERPRINT_VERSION, vector.astype(np.float32).tobytes()
+
+
+class SimilarityIndex:
+    """
+    In-memory matrix of all fingerprints, rebuilt when the change log moves.
+
+    The cache is keyed on the sync generation as well as the cursor, so a
+    restore done in another worker (which can leave the cursor unchanged)
+    still forces a rebuild here.
+
+    Rows are L2-normalised, so one matrix-vector product gives the cosine
+    similarity against every song at once.
+    """
+
+    def __init__(self, upload_folder):
+        self.upload_folder = upload_folder
+        self._lock = threading.Lock()
+        self._version = None
+        self._song_ids = []
+        self._positions = {}
+        self._matrix = None
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+
+    def _refresh(self):
+        import numpy as np
+
+        version = (get_sync_generation(), get_change_cursor())
+        with self._lock:
+            if version != self._version:
+                stored = get_fingerprints(FINGERPRINT_VERSION)
+                self._backfill(stored)
+                song_ids = [song_id for song_id, vector in stored.items() if vector]
+                matrix = np.frombuffer(b''.join(stored[song_id] for song_id in song_ids), dtype=np.float32)
+                self._song_ids = song_ids
+                self._positions = {song_id: i for i, song_id in enumerate(song_ids)}
+                self._matrix = matrix.reshape(len(song_ids), FINGERPRINT_SIZE)
+                self._version = version
+            return self._song_ids, self._positions, self._matrix
+
+    def _backfill(self, stored):
+        # Songs uploaded before fingerprinting existed, or with an outdated version
+        for song in get_all_songs():
+            if song['id'] in stored or not song['midi_filename']:
+                continue
+            filepath = os.path.join(self.upload_folder, song['midi_filename'])
+            if not os.path.exists(filepath):
+                continue
+            fingerprint = pack_fingerprint(compute_midi_fingerprint(filepath))
+            save_fingerprint(song['id'], fingerprint)
+            stored[song['id']] = fingerprint[1]
+
+    def search(self, vector, limit=10, min_score=0.0, exclude=None):
+        """
+        Find the songs whose fingerprints are closest to vector.
+
+        Args:
+            vector (numpy.ndarray): Query fingerprint
+            limit (int): Maximum number of results
+            min_score (float): Minimum cosine similarity to include
+            exclude (str): Song id to leave out, usually the query song itself
+
+        Returns:
+            list: (song id, similarity) pairs, most similar first
+        """
+        import numpy as np
+
+        song_ids, positions, matrix = self._refresh()
+        if not song_ids or limit <= 0:
+            return []
+
+        scores = matrix @ vector.astype(np.float32)
+        if exclude in positions:
+            scores[positions[exclude]] = -np.inf
+
+        k = min(limit, len(song_ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(song_ids[i], float(scores[i])) for i in top if scores[i] >= min_score]
+
+    def similar_to(self, song_id, limit=10):
+        song_ids, positions, matrix = self._refresh()
+        if song_id not in positions:
+            return []
+        return self.search(matrix[positions[song_id]], limit=limit, exclude=song_id)
@@ -0,0 +1,211 @@
+"""
+Command line client that mirrors the MIDI library into a local folder.
+Uses the /api/sync endpoints so only changed files are downloaded after the first run.
+
+Usage:
+    python sync_client.py http://localhost:5000 ./midi --user NAME --password PASS
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import shutil
+import sys
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+STATE_FILENAME = '.sleepy_sync.json'
+TEMP_PREFIX = '.sleepy_sync_'
+
+
+class SyncClient:
+    def __init__(self, server, username, password):
+        self.server = server.rstrip('/')
+        token = base64.b64encode(f"{username}:{password}".encode('utf-8')).decode('ascii')
+        self.auth_header = f"Basic {token}"
+
+    def _open(self, path):
+        url = urllib.parse.urljoin(self.server + '/', path.lstrip('/'))
+        req = urllib.request.Request(url, headers={'Authorization': self.auth_header})
+        return urllib.request.urlopen(req, timeout=60)
+
+    def get_json(self, path):
+        with self._open(path) as resp:
+            return json.loads(resp.read().decode('utf-8'))
+
+    def download(self, entry, target_path):
+        """
+        Download one entry to target_path, verifying its content hash.
+
+        Args:
+            entry (dict): Manifest entry with url and sha256
+            target_path (str): Final path of the file
+
+        Returns:
+            str: target_path once the file is in place
+        """
+        temp_path = target_path + '.part'
+        sha256 = hashlib.sha256()
+        with self._open(entry['url']) as resp, open(temp_path, 'wb') as f:
+            for chunk in iter(lambda: resp.read(65536), b''):
+                sha256.update(chunk)
+                f.write(chunk)
+
+        if sha256.hexdigest() != entry['sha256']:
+            os.remove(temp_path)
+            raise ValueError(f"hash mismatch for {entry['name']}")
+
+        os.replace(temp_path, target_path)
+        return target_path
+
+
+# Path separators plus characters Windows does not allow in file names
+_UNSAFE_CHARS = str.maketrans({c: '_' for c in '/\\:*?"<>|'})
+
+
+def _local_name(name):
+    # Song names are free text; keep them inside the target folder and valid on every OS
+    name = ''.join(c for c in name if ord(c) >= 32).translate(_UNSAFE_CHARS)
+    # Windows also strips trailing dots and spaces, which would make names collide
+    stem, dot, extension = name.rpartition('.')
+    return stem.rstrip('. ') + dot + extension
+
+
+def load_state(folder):
+    state_path = os.path.join(folder, STATE_FILENAME)
+    if os.path.exists(state_path):
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return None
+
+
+def save_state(folder, state):
+    state_path = os.path.join(folder, STATE_FILENAME)
+    temp_path = state_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, state_path)
+
+
+def sync(client, folder, workers=4):
+    """
+    Bring folder up to date with the server.
+
+    Files whose content already exists locally (e.g. renamed after a face_id
+    renumbering) are moved instead of downloaded again.
+
+    Returns:
+        tuple: (number downloaded, number renamed, number removed)
+    """
+    os.makedirs(folder, exist_ok=True)
+    state = load_state(folder)
+    if state is not None and state.get('server') != client.server:
+        state = None
+
+    if state is None:
+        feed = client.get_json('/api/sync/manifest')
+        feed['reset'] = True
+        state = {'server': client.server, 'generation': None, 'cursor': 0, 'files': {}}
+    else:
+        query = urllib.parse.urlencode({'since': state['cursor'], 'generation': state.get('generation', '')})
+        feed = client.get_json(f"/api/sync/changes?{query}")
+
+    local_files = state['files']
+    desired = {_local_name(entry['name']): entry for entry in feed['entries']}
+
+    if feed['reset']:
+        affected = set(local_files)
+    else:
+        touched = set(feed['changed']) | set(feed['deleted'])
+        affected = {name for name, info in local_files.items() if info['song_id'] in touched}
+
+    # Park obsolete files under their hash so renumbered files can be reused
+    parked = {}
+    removed = 0
+    for name in affected:
+        info = local_files.pop(name)
+        path = os.path.join(folder, name)
+        if not os.path.exists(path):
+            continue
+        target = desired.get(name)
+        if target and target['sha256'] == info['sha256']:
+            local_files[name] = info
+            continue
+        if info['sha256'] in parked:
+            os.remove(path)
+            removed += 1
+        else:
+            parked_path = os.path.join(folder, f"{TEMP_PREFIX}{info['sha256']}")
+            os.replace(path, parked_path)
+            parked[info['sha256']] = parked_path
+
+    renamed = 0
+    reused = set()
+    to_download = []
+    for name, entry in desired.items():
+        current = local_files.get(name)
+        if current and current['sha256'] == entry['sha256'] and os.path.exists(os.path.join(folder, name)):
+            continue
+        path = os.path.join(folder, name)
+        if entry['sha256'] in parked:
+            shutil.copyfile(parked[entry['sha256']], path)
+            reused.add(entry['sha256'])
+            local_files[name] = {'song_id': entry['song_id'], 'sha256': entry['sha256']}
+            renamed += 1
+        else:
+            to_download.append((name, entry))
+
+    for sha256, parked_path in parked.items():
+        os.remove(parked_path)
+        if sha256 not in reused:
+            removed += 1
+
+    failures = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(client.download, entry, os.path.join(folder, name)): (name, entry)
+            for name, entry in to_download
+        }
+        for future, (name, entry) in futures.items():
+            try:
+                future.result()
+                local_files[name] = {'song_id': entry['song_id'], 'sha256': entry['sha256']}
+            except Exception as e:
+                failures.append(f"{name}: {e}")
+
+    # Only advance the cursor once everything landed, so a failed run is retried next time
+    if not failures:
+        state['generation'] = feed['generation']
+        state['cursor'] = feed['cursor']
+    save_state(folder, state)
+
+    if failures:
+        raise RuntimeError("同步未完成:\n" + "\n".join(failures))
+
+    return len(to_download), renamed, removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='同步MIDI库到本地文件夹')
+    parser.add_argument('server', help='服务器地址，例如 http://localhost:5000')
+    parser.add_argument('folder', help='本地目标文件夹')
+    parser.add_argument('--user', default=os.getenv('AUTH_USERNAME'), help='用户名 (默认读取 AUTH_USERNAME)')
+    parser.add_argument('--password', default=os.getenv('AUTH_PASSWORD'), help='密码 (默认读取 AUTH_PASSWORD)')
+    parser.add_argument('--workers', type=int, default=4, help='并行下载数')
+    args = parser.parse_args()
+
+    client = SyncClient(args.server, args.user or '', args.password or '')
+    try:
+        downloaded, renamed, removed = sync(client, args.folder, workers=args.workers)
+    except Exception as e:
+        print(f"同步失败: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"同步完成: 下载 {downloaded} 个, 重命名 {renamed} 个, 删除 {removed} 个")
+
+
+if __name__ == '__main__':
+    main()